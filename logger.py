@@ -1,6 +1,12 @@
 # logger.py
 from flask import Flask, request, jsonify
+import atexit
 import json
+import queue
+import signal
+import sys
+import threading
+import time
 from datetime import datetime
 from zoneinfo import ZoneInfo
 from config import LOGFILE  # Import from config
@@ -12,11 +18,95 @@ from process_logfile import (
     get_pay_period_detail,
     get_pay_history,  # Add this import
     process_all,
+    logfile_lock,
+    is_current_logfile,
 )
 
+# Prefer orjson for encoding log entries, falling back to the stdlib encoder
+# with the same compact output
+try:
+    from orjson import dumps as json_dumps
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(",", ":")).encode()
+
 EASTERN = ZoneInfo("America/New_York")
+_now = datetime.now  # bound once for the /log hot path
 app = Flask(__name__)
 
+# Requests only enqueue their encoded entry; a background writer thread
+# appends whatever has queued up to the logfile in one write.
+# process_logfile moves the logfile aside before processing, so the handle
+# is reopened whenever LOGFILE no longer points at the file it has open.
+# The check and the write happen under the logfile lock, which processors
+# (including cron runs) also take before renaming the file.
+_log_queue = queue.Queue()
+_log_lock = threading.Lock()  # held while writing and while processing
+_log_fh = open(LOGFILE, "ab", buffering=0)
+LOG_RETRY_DELAY = 0.1  # seconds, doubled after each failed write
+LOG_RETRY_MAX_DELAY = 30
+
+
+def _write_batch(buf):
+    """
+    Append buf to the current logfile (caller holds _log_lock). Written bytes
+    are removed from buf, so after an error it holds only what is left.
+    """
+    global _log_fh
+    while True:
+        with logfile_lock(_log_fh):
+            if is_current_logfile(_log_fh):
+                # Unbuffered writes may be short; finish before unlocking so
+                # a processor never sees half a line
+                while buf:
+                    del buf[:_log_fh.write(buf)]
+                return
+        # Open the new file first so a failed open leaves a usable handle
+        fh = open(LOGFILE, "ab", buffering=0)
+        _log_fh.close()
+        _log_fh = fh
+
+
+def _log_writer():
+    pending = bytearray()
+    count = 0
+    delay = LOG_RETRY_DELAY
+    while True:
+        if not count:
+            pending += _log_queue.get()
+            count = 1
+        while True:
+            try:
+                pending += _log_queue.get_nowait()
+            except queue.Empty:
+                break
+            count += 1
+
+        try:
+            with _log_lock:
+                _write_batch(pending)
+        except OSError as e:
+            # The entries were already acknowledged, so keep what is left of
+            # the batch and retry it (with anything queued since)
+            print(f"Log write error, retrying in {delay:g}s: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, LOG_RETRY_MAX_DELAY)
+            continue
+
+        for _ in range(count):
+            _log_queue.task_done()
+        count = 0
+        delay = LOG_RETRY_DELAY
+
+
+def _flush_log():
+    """Block until every queued entry has been written"""
+    _log_queue.join()
+
+
+threading.Thread(target=_log_writer, daemon=True).start()
+atexit.register(_flush_log)
+
 
 @app.route("/log", methods=["POST"])
 def log_entry():
@@ -26,10 +116,9 @@ def log_entry():
         return jsonify({"status": "ignored", "message": "Unsupported log type"}), 200
 
     # Add timestamp
-    data["received_at"] = datetime.now(EASTERN).isoformat()
+    data["received_at"] = _now(EASTERN).isoformat()
 
-    with open(LOGFILE, "a") as f:
-        f.write(json.dumps(data) + "\n")
+    _log_queue.put(json_dumps(data) + b"\n")
 
     print(f"📥 Logged: {data}")
     return jsonify({"status": "logged", "message": "Entry saved"}), 200
@@ -44,47 +133,51 @@ def query_data():
     try:
         if query_type == "pay_status":
             info = get_current_pay_period_info()
-            response = (
-                f"Pay Period: {info['period_start']} - {info['period_end']}\n"
-                f"Day {info['current_day']} of 14 (Week {info['current_week']})\n"
-                f"Hours: {info['hours_logged']:.1f} (W1: {info['week1_hours']:.1f}, W2: {info['week2_hours']:.1f})\n"
-            )
-            
-            response += f"Work days left: {info['remaining_work_days']}\n"
+            parts = [
+                f"Pay Period: {info['period_start']} - {info['period_end']}\n",
+                f"Day {info['current_day']} of 14 (Week {info['current_week']})\n",
+                f"Hours: {info['hours_logged']:.1f} (W1: {info['week1_hours']:.1f}, W2: {info['week2_hours']:.1f})\n",
+                f"Work days left: {info['remaining_work_days']}\n",
+            ]
 
             if info["avg_hours_needed"] > 0:
-                response += f"Need {info['avg_hours_needed']:.1f} hrs/day for 80 total"
+                parts.append(f"Need {info['avg_hours_needed']:.1f} hrs/day for 80 total")
+
+            response = "".join(parts)
 
         elif query_type == "pay_detail":
             # PAYDETAIL function
             result = get_pay_period_detail()
-            response = f"Pay Period: {result['period_start']} - {result['period_end']}\n"
-            
+
             if result['daily_hours']:
+                parts = [f"Pay Period: {result['period_start']} - {result['period_end']}\n"]
                 for entry in result['daily_hours']:
-                    response += f"{entry['date']}: {entry['hours']:.1f} hrs\n"
-                response += f"Total: {result['total_hours']:.1f} hrs ({result['days_worked']} days)"
+                    parts.append(f"{entry['date']}: {entry['hours']:.1f} hrs\n")
+                parts.append(f"Total: {result['total_hours']:.1f} hrs ({result['days_worked']} days)")
+                response = "".join(parts)
             else:
                 response = "No hours logged this pay period"
 
         elif query_type == "pay_history":
             # PAYHISTORY - Show last 3 pay periods with weekly breakdown
             history = get_pay_history(3)
-            response = "Pay Period History:\n"
-            
+            parts = ["Pay Period History:\n"]
+
             for i, period in enumerate(history):
                 if i == 0:
-                    response += "Current: "
+                    parts.append("Current: ")
                 else:
-                    response += f"Period -{i}: "
-                
-                response += f"{period['total_hours']:.1f}hrs "
-                response += f"(W1: {period['week1_hours']:.1f}, W2: {period['week2_hours']:.1f})"
-                
+                    parts.append(f"Period -{i}: ")
+
+                parts.append(f"{period['total_hours']:.1f}hrs ")
+                parts.append(f"(W1: {period['week1_hours']:.1f}, W2: {period['week2_hours']:.1f})")
+
                 if period['overtime_hours'] > 0:
-                    response += f" OT: {period['overtime_hours']:.1f}"
-                
-                response += "\n"
+                    parts.append(f" OT: {period['overtime_hours']:.1f}")
+
+                parts.append("\n")
+
+            response = "".join(parts)
 
         elif query_type == "hours_check":
             # Validate hours with bi-weekly handling
@@ -107,15 +200,16 @@ def query_data():
             )
             if results:
                 if data.get("name"):
-                    response = f"Mileage for {data.get('name')}:\n"
+                    parts = [f"Mileage for {data.get('name')}:\n"]
                 else:
-                    response = "Recent mileage:\n"
+                    parts = ["Recent mileage:\n"]
 
                 for r in results[:5]:  # Limit for SMS
-                    response += f"{r['date']}: {r['name']} - {r['miles']:.1f}mi\n"
+                    parts.append(f"{r['date']}: {r['name']} - {r['miles']:.1f}mi\n")
 
                 total = sum(r["miles"] for r in results)
-                response += f"Total: {total:.1f}mi"
+                parts.append(f"Total: {total:.1f}mi")
+                response = "".join(parts)
             else:
                 response = "No mileage data found"
 
@@ -124,9 +218,10 @@ def query_data():
             today = datetime.now().strftime("%Y-%m-%d")
             results = get_summary_data(date=today)
             if results:
-                response = "Today's mileage:\n"
+                parts = ["Today's mileage:\n"]
                 for r in results:
-                    response += f"{r['name']}: {r['miles']:.1f}mi\n"
+                    parts.append(f"{r['name']}: {r['miles']:.1f}mi\n")
+                response = "".join(parts)
             else:
                 response = "No mileage logged today"
 
@@ -134,12 +229,13 @@ def query_data():
             # This week's hours
             results = get_hours_data(days=7)
             if results:
-                response = "This week's hours:\n"
+                parts = ["This week's hours:\n"]
                 total = 0
                 for r in results[:7]:
-                    response += f"{r['date']}: {r['hours_today']:.1f}hrs\n"
+                    parts.append(f"{r['date']}: {r['hours_today']:.1f}hrs\n")
                     total += r["hours_today"]
-                response += f"Week total: {total:.1f}hrs"
+                parts.append(f"Week total: {total:.1f}hrs")
+                response = "".join(parts)
             else:
                 response = "No hours data found"
 
@@ -157,7 +253,11 @@ def query_data():
 def trigger_processing():
     """Manually trigger processing of logfile"""
     try:
-        result = process_all()
+        # Write out queued entries and hold off the writer while the logfile
+        # is moved aside
+        _flush_log()
+        with _log_lock:
+            result = process_all()
         return jsonify({"status": "success", "processed": result}), 200
     except Exception as e:
         print(f"Processing error: {e}")
@@ -171,4 +271,6 @@ def health_check():
 
 
 if __name__ == "__main__":
+    # Exit cleanly on SIGTERM (e.g. docker stop) so atexit flushes the log
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run(host="0.0.0.0", port=10000)
\ No newline at end of file
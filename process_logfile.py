@@ -1,181 +1,416 @@
 # process_logfile.py
+import glob
 import json
+import os
 import sqlite3
-import uuid
-from collections import defaultdict
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from functools import lru_cache
 import logging
 from config import DB_FILE, LOGFILE, SCHEMA, PAY_PERIOD_START  # Import from config
 
+# Advisory locks on the logfile keep logger.py from appending to it while a
+# processor moves it aside (not available on Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# orjson is much faster at parsing the logfile; fall back to the stdlib parser
+# if it isn't installed. Bad lines raise a ValueError from either parser
+# (JSONDecodeError, or UnicodeDecodeError from json.loads on invalid UTF-8).
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger(__name__)
 
+# While a run processes the logfile it is renamed to
+# "<LOGFILE>.<pid>.processing", so entries logged in the meantime start a
+# fresh LOGFILE and concurrent processors never share a file
+PROCESSING_SUFFIX = ".processing"
+
+# A processing file whose entries can't be stored is renamed to
+# "<LOGFILE>.<pid>.<timestamp>.failed" so later runs don't retry it forever
+FAILED_SUFFIX = ".failed"
+
+# The "type" field as written by logger.py (orjson, compact) and by older
+# versions (json.dumps), so entries can be routed without parsing every line
+MILEAGE_MARKERS = (b'"type":"mileage"', b'"type": "mileage"')
+HOURS_MARKERS = (b'"type":"hours"', b'"type": "hours"')
+
+# WAL lets the query endpoints read while a batch is being written, and
+# synchronous=NORMAL is safe under WAL (only the last commit can be lost on
+# power failure, never corruption)
+SQLITE_PRAGMAS = """
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+PRAGMA cache_size=-20000;
+"""
+
+
+# One connection per thread, reused across calls. Connections run in
+# autocommit mode; writers group their statements with _transaction().
+_tls = threading.local()
+
+
+def _connect():
+    """Open a database connection with the tuning pragmas applied"""
+    conn = sqlite3.connect(DB_FILE, isolation_level=None)
+    conn.executescript(SQLITE_PRAGMAS)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _conn():
+    """Return this thread's database connection, opening it on first use"""
+    conn = getattr(_tls, "conn", None)
+    if conn is None:
+        conn = _tls.conn = _connect()
+    return conn
+
+
+@contextmanager
+def _transaction(conn):
+    """Run the block in a write transaction, joining one that is already open"""
+    if conn.in_transaction:
+        yield
+        return
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+@contextmanager
+def logfile_lock(f):
+    """Hold an exclusive lock on an open logfile for the duration of the block"""
+    _flock(f)
+    try:
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _flock(f, blocking=True):
+    """
+    Take an exclusive lock on an open file. Without blocking, returns False
+    if another open file holds it. Locks are released when the holder closes
+    the file or exits, however it exits.
+    """
+    if fcntl is None:
+        return True
+    flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+    try:
+        fcntl.flock(f.fileno(), flags)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def _same_file(path, f):
+    """Whether path still names the file open as f"""
+    try:
+        return os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+    except FileNotFoundError:
+        return False
+
+
+def is_current_logfile(f):
+    """Whether LOGFILE still names the file open as f"""
+    return _same_file(LOGFILE, f)
+
+
+@contextmanager
+def _read_transaction(conn):
+    """Run the block's queries against one snapshot, joining an open transaction"""
+    if conn.in_transaction:
+        yield
+        return
+
+    conn.execute("BEGIN")
+    try:
+        yield
+    finally:
+        conn.commit()
+
+
+_db_initialized = False
+
 
 def init_db():
-    """Initialize database with schema"""
-    with sqlite3.connect(DB_FILE) as conn:
-        with open(SCHEMA) as f:
-            conn.executescript(f.read())
+    """Initialize database with schema (once per process)"""
+    global _db_initialized
+    if _db_initialized:
+        return
+
+    conn = _conn()
+    with open(SCHEMA) as f:
+        conn.executescript(f.read())
+    _db_initialized = True
     logger.info("Database initialized")
 
 
-def load_entries():
-    """Load and parse entries from logfile"""
-    entries = []
+def load_entries(path=LOGFILE):
+    """Load and parse entries from logfile, split into (mileage, hours) lists"""
+    mileage_entries, hours_entries = [], []
     try:
-        with open(LOGFILE, "r") as f:
-            for line in f:
-                if line.strip():
-                    try:
-                        entries.append(json.loads(line.strip()))
-                    except json.JSONDecodeError:
-                        logger.warning(f"Skipped malformed line: {line}")
+        # The logfile is small (it is cleared after every run), so read it in
+        # one call and split instead of iterating line by line
+        with open(path, "rb") as f:
+            data = f.read()
     except FileNotFoundError:
         logger.warning("Logfile not found")
-
-    return entries
+        return mileage_entries, hours_entries
+
+    targets = {"mileage": mileage_entries, "hours": hours_entries}
+    for line in data.splitlines():
+        # Pre-filter on the raw bytes so lines of other types are never parsed
+        if not any(marker in line for marker in MILEAGE_MARKERS + HOURS_MARKERS):
+            if line.strip():
+                logger.warning(f"Skipped unrecognized line: {line.decode(errors='replace')}")
+            continue
+
+        # Both parsers accept bytes directly
+        try:
+            entry = json_loads(line)
+        except ValueError:
+            logger.warning(f"Skipped malformed line: {line.decode(errors='replace')}")
+            continue
+
+        # The marker may come from a nested field, so route on the parsed type
+        target = targets.get(entry.get("type")) if isinstance(entry, dict) else None
+        if target is None:
+            logger.warning(f"Skipped unrecognized line: {line.decode(errors='replace')}")
+            continue
+        target.append(entry)
+
+    return mileage_entries, hours_entries
+
+
+# Fields each entry type needs; the matching columns are NOT NULL
+MILEAGE_FIELDS = ("name", "date", "position", "distance", "received_at")
+HOURS_FIELDS = ("date", "hours_today", "hours_week", "received_at")
+
+
+def _valid_entries(entries, fields, kind):
+    """Drop entries missing a required field so one bad line can't fail the batch"""
+    valid = []
+    for entry in entries:
+        if isinstance(entry, dict) and all(entry.get(field) is not None for field in fields):
+            valid.append(entry)
+        else:
+            logger.debug(f"Skipped invalid {kind}: {entry}")
+    return valid
 
 
-def process_mileage(entries):
+def process_mileage(mileage_entries):
     """Process mileage entries into raw and summary tables"""
-    mileage_entries = [e for e in entries if e.get("type") == "mileage"]
-
+    mileage_entries = _valid_entries(mileage_entries, MILEAGE_FIELDS, "mileage")
     if not mileage_entries:
         return 0
 
-    processed_count = 0
+    rows = [
+        (
+            entry.get("id") or None,
+            entry["name"],
+            entry["date"],
+            entry["position"],
+            entry["distance"],
+            entry["received_at"],
+        )
+        for entry in mileage_entries
+    ]
 
-    with sqlite3.connect(DB_FILE) as conn:
+    conn = _conn()
+    with _transaction(conn):
         cursor = conn.cursor()
 
-        # Insert into mileage_raw
-        for entry in mileage_entries:
-            try:
-                entry_id = entry.get("id") or str(uuid.uuid4())
-                cursor.execute(
-                    """
-                    INSERT INTO mileage_raw (id, name, date, position, distance, received_at)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                    """,
-                    (
-                        entry_id,
-                        entry["name"],
-                        entry["date"],
-                        entry["position"],
-                        entry["distance"],
-                        entry["received_at"],
-                    ),
-                )
-                processed_count += 1
-            except sqlite3.IntegrityError:
-                logger.debug(f"Skipped duplicate mileage: {entry}")
-
-        conn.commit()
-
-        # Calculate and update summaries
-        cursor.execute(
+        # Insert into mileage_raw in one batch; duplicates are ignored.
+        # Entries without an id get one generated by SQLite.
+        cursor.executemany(
             """
-            SELECT name, date, position, distance 
-            FROM mileage_raw 
-            ORDER BY name, date, position
-        """
+            INSERT OR IGNORE INTO mileage_raw (id, name, date, position, distance, received_at)
+            VALUES (COALESCE(?, lower(hex(randomblob(16)))), ?, ?, ?, ?, ?)
+            """,
+            rows,
         )
-        rows = cursor.fetchall()
-
-        grouped = defaultdict(lambda: {"start": None, "mid": None, "end": None})
-        for name, date, position, distance in rows:
-            grouped[(name, date)][position] = distance
-
-        # Update mileage_summary
-        for (name, date), parts in grouped.items():
-            start = parts["start"]
-            mid = parts["mid"]
-            end = parts["end"]
-
-            total_miles = None
-
-            if start is not None and end is not None:
-                total_miles = end - start
-            elif mid is not None:
-                # Estimate from midpoint
-                total_miles = mid * 2
-                logger.info(
-                    f"Estimated mileage for {name} on {date} from midpoint: {total_miles:.1f}"
-                )
+        processed_count = cursor.rowcount
+        if processed_count < len(rows):
+            logger.debug(f"Skipped {len(rows) - processed_count} duplicate mileage entries")
 
-            if total_miles is not None and total_miles > 0:
-                cursor.execute(
-                    """
-                    INSERT OR REPLACE INTO mileage_summary (id, name, date, total_miles)
-                    VALUES (
-                        COALESCE(
-                            (SELECT id FROM mileage_summary WHERE name = ? AND date = ?),
-                            ?
-                        ),
-                        ?, ?, ?
-                    )
-                    """,
-                    (name, date, str(uuid.uuid4()), name, date, total_miles),
+        # Recalculate summaries only for the (name, date) pairs in this batch,
+        # staged in a temp table so the batch size isn't bound by SQL variables
+        cursor.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS mileage_dirty "
+            "(name TEXT, date TEXT, PRIMARY KEY (name, date)) WITHOUT ROWID"
+        )
+        cursor.execute("DELETE FROM mileage_dirty")
+        cursor.executemany(
+            "INSERT OR IGNORE INTO mileage_dirty (name, date) VALUES (?, ?)",
+            [(entry["name"], entry["date"]) for entry in mileage_entries],
+        )
+        cursor.execute(
+            """
+            INSERT INTO mileage_summary (id, name, date, total_miles)
+            SELECT lower(hex(randomblob(16))), name, date, total
+            FROM (
+                SELECT
+                    name,
+                    date,
+                    CASE
+                        WHEN MAX(CASE WHEN position = 'start' THEN distance END) IS NOT NULL
+                         AND MAX(CASE WHEN position = 'end' THEN distance END) IS NOT NULL
+                        THEN MAX(CASE WHEN position = 'end' THEN distance END)
+                           - MAX(CASE WHEN position = 'start' THEN distance END)
+                        -- Estimate from midpoint
+                        ELSE 2 * MAX(CASE WHEN position = 'mid' THEN distance END)
+                    END AS total
+                FROM (
+                    -- The latest reading per position wins, so a re-sent
+                    -- correction replaces the earlier value. SQLite returns
+                    -- the bare distance column from the row holding MAX(rowid).
+                    SELECT name, date, position, distance, MAX(mileage_raw.rowid)
+                    FROM mileage_dirty
+                    JOIN mileage_raw USING (name, date)
+                    GROUP BY name, date, position
                 )
-
-        conn.commit()
+                GROUP BY name, date
+            )
+            WHERE total > 0
+            ON CONFLICT(name, date) DO UPDATE SET
+                total_miles = excluded.total_miles,
+                updated_at = CURRENT_TIMESTAMP
+            """
+        )
 
     logger.info(f"Processed {processed_count} mileage entries")
     return processed_count
 
 
-def process_hours(entries):
+def process_hours(hours_entries):
     """Process hours entries"""
-    hours_entries = [e for e in entries if e.get("type") == "hours"]
-
+    hours_entries = _valid_entries(hours_entries, HOURS_FIELDS, "hours")
     if not hours_entries:
         return 0
 
-    processed_count = 0
+    rows = [
+        (
+            entry.get("id") or None,
+            entry["date"],
+            entry["hours_today"],
+            entry["hours_week"],
+            entry["received_at"],
+        )
+        for entry in hours_entries
+    ]
 
-    with sqlite3.connect(DB_FILE) as conn:
+    conn = _conn()
+    with _transaction(conn):
         cursor = conn.cursor()
 
-        for entry in hours_entries:
-            try:
-                entry_id = entry.get("id") or str(uuid.uuid4())
-                cursor.execute(
-                    """
-                    INSERT OR REPLACE INTO hours (id, date, hours_today, hours_week, received_at)
-                    VALUES (
-                        COALESCE(
-                            (SELECT id FROM hours WHERE date = ?),
-                            ?
-                        ),
-                        ?, ?, ?, ?
-                    )
-                    """,
-                    (
-                        entry["date"],
-                        entry_id,
-                        entry["date"],
-                        entry["hours_today"],
-                        entry["hours_week"],
-                        entry["received_at"],
-                    ),
-                )
-                processed_count += 1
-            except sqlite3.IntegrityError:
-                logger.debug(f"Skipped duplicate hours: {entry}")
-
-        conn.commit()
+        # Later entries for the same date update the existing row in place,
+        # keeping its id. A new date takes the entry's id unless it is missing
+        # or already used by another date, in which case one is generated.
+        cursor.executemany(
+            """
+            INSERT INTO hours (id, date, hours_today, hours_week, received_at)
+            VALUES (
+                CASE WHEN ?1 IS NULL OR EXISTS (SELECT 1 FROM hours WHERE id = ?1)
+                     THEN lower(hex(randomblob(16))) ELSE ?1 END,
+                ?2, ?3, ?4, ?5
+            )
+            ON CONFLICT(date) DO UPDATE SET
+                hours_today = excluded.hours_today,
+                hours_week = excluded.hours_week,
+                received_at = excluded.received_at
+            """,
+            rows,
+        )
+        processed_count = cursor.rowcount
 
     logger.info(f"Processed {processed_count} hours entries")
     return processed_count
 
 
-def clear_logfile():
-    """Clear the logfile after successful processing"""
-    open(LOGFILE, "w").close()
-    logger.info("Logfile cleared")
+def _stale_processing_files():
+    """
+    Processing files left by failed runs. A processor holds a lock on its
+    processing file until it finishes, so any file that can be locked has
+    no live owner, even if its pid has since been reused.
+    """
+    own = f"{LOGFILE}.{os.getpid()}{PROCESSING_SUFFIX}"
+    paths = glob.glob(glob.escape(LOGFILE) + ".*" + PROCESSING_SUFFIX)
+    # Without fcntl there is no lock to check, so only this process's own
+    # leftover file is known to be safe to take
+    if fcntl is None:
+        return [path for path in paths if path == own]
+
+    stale = []
+    for path in sorted(paths, key=lambda path: path != own):
+        try:
+            with open(path, "rb") as f:
+                if _flock(f, blocking=False):
+                    stale.append(path)
+        except FileNotFoundError:
+            continue
+    return stale
+
+
+def _claim(path, target):
+    """
+    Lock the file at path and move it to target. Returns the open file, whose
+    lock marks it as owned until it is closed, or None if it was taken.
+    """
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    # Check the name once locked: another processor may have moved the file
+    # while we waited (or, for a stale file, claimed and finished it)
+    if _flock(f, blocking=path == LOGFILE) and _same_file(path, f):
+        if path != target:
+            os.rename(path, target)
+        return f
+    f.close()
+    return None
+
+
+def rotate_logfile():
+    """
+    Move the logfile aside for this process and return (path, lock_file) to
+    read, or None if there is nothing to process. lock_file must stay open
+    until processing ends. A file left by a failed run is claimed and
+    processed first; new entries then wait for the next run.
+    """
+    path = f"{LOGFILE}.{os.getpid()}{PROCESSING_SUFFIX}"
+    for stale in _stale_processing_files():
+        lock_file = _claim(stale, path)
+        if lock_file is not None:
+            logger.warning(f"Resuming unfinished processing file {stale}")
+            return path, lock_file
+
+    # Rename under the logfile lock so a writer is never mid-append; writers
+    # check the file is still LOGFILE once they hold the lock
+    while os.path.exists(LOGFILE):
+        lock_file = _claim(LOGFILE, path)
+        if lock_file is not None:
+            return path, lock_file
+        # Moved aside by another processor while we waited; try again
+    return None
 
 
 def get_summary_data(name=None, date=None, days=7):
@@ -183,65 +418,67 @@ def get_summary_data(name=None, date=None, days=7):
     Get summary data for API responses
     This could be called by your Flask app to respond to SMS queries
     """
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
+    conn = _conn()
+    cursor = conn.cursor()
 
-        # Build query based on parameters
-        query = "SELECT name, date, total_miles FROM mileage_summary WHERE 1=1"
-        params = []
+    # Build query based on parameters
+    query = "SELECT name, date, total_miles AS miles FROM mileage_summary WHERE 1=1"
+    params = []
 
-        if name:
-            query += " AND name = ?"
-            params.append(name)
+    if name:
+        query += " AND name = ?"
+        params.append(name)
 
-        if date:
-            query += " AND date = ?"
-            params.append(date)
-        else:
-            # Get last N days
-            query += " AND date >= date('now', '-' || ? || ' days')"
-            params.append(days)
-
-        query += " ORDER BY date DESC, name"
+    if date:
+        query += " AND date = ?"
+        params.append(date)
+    else:
+        # Get last N days
+        query += " AND date >= date('now', '-' || ? || ' days')"
+        params.append(days)
 
-        cursor.execute(query, params)
+    query += " ORDER BY date DESC, name"
 
-        results = []
-        for row in cursor.fetchall():
-            results.append({"name": row[0], "date": row[1], "miles": row[2]})
+    cursor.execute(query, params)
 
-        return results
+    # Rows are sqlite3.Row, so the column names become the dict keys
+    return [dict(row) for row in cursor]
 
 
 def get_hours_data(date=None, days=7, date_start=None, date_end=None):
     """Get hours data for API responses"""
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
+    conn = _conn()
+    cursor = conn.cursor()
+
+    query = "SELECT date, hours_today, hours_week FROM hours WHERE 1=1"
+    params = []
+
+    if date_start and date_end:
+        query += " AND date >= ? AND date <= ?"
+        params.extend([date_start, date_end])
+    elif date:
+        query += " AND date = ?"
+        params.append(date)
+    else:
+        query += " AND date >= date('now', '-' || ? || ' days')"
+        params.append(days)
 
-        query = "SELECT date, hours_today, hours_week FROM hours WHERE 1=1"
-        params = []
+    query += " ORDER BY date DESC"
 
-        if date_start and date_end:
-            query += " AND date >= ? AND date <= ?"
-            params.extend([date_start, date_end])
-        elif date:
-            query += " AND date = ?"
-            params.append(date)
-        else:
-            query += " AND date >= date('now', '-' || ? || ' days')"
-            params.append(days)
+    cursor.execute(query, params)
 
-        query += " ORDER BY date DESC"
+    return [dict(row) for row in cursor]
 
-        cursor.execute(query, params)
 
-        results = []
-        for row in cursor.fetchall():
-            results.append(
-                {"date": row[0], "hours_today": row[1], "hours_week": row[2]}
-            )
+@lru_cache(maxsize=4096)
+def _parse_ymd(date_str):
+    """Parse a YYYY-MM-DD string, caching results since the same dates recur"""
+    return datetime.strptime(date_str, "%Y-%m-%d")
 
-        return results
+
+def _ymd_from_ordinal(ordinal):
+    """Format a proleptic Gregorian ordinal as YYYY-MM-DD"""
+    return datetime.fromordinal(ordinal).date().isoformat()
 
 
 def get_pay_period_dates(date=None, pay_period_start_date=None):
@@ -254,127 +491,148 @@ def get_pay_period_dates(date=None, pay_period_start_date=None):
         date: The date to check (YYYY-MM-DD format), defaults to today
         pay_period_start_date: A known pay period start date (Monday)
     """
-    if not pay_period_start_date:
-        pay_period_start_date = PAY_PERIOD_START
-        
+    # Known pay period start (Monday)
+    if not pay_period_start_date or pay_period_start_date == PAY_PERIOD_START:
+        known_start_ord = _KNOWN_START_ORD
+    else:
+        known_start_ord = _parse_pay_period_start(pay_period_start_date).toordinal()
+
     if date:
-        check_date = datetime.strptime(date, "%Y-%m-%d")
+        check_ord = _parse_ymd(date).toordinal()
     else:
-        check_date = datetime.now()
+        check_ord = datetime.now().toordinal()
 
-    # Known pay period start (Monday)
-    known_start = datetime.strptime(pay_period_start_date, "%Y-%m-%d")
+    # Copy so callers can't modify the cached result
+    return dict(_pay_period_dates_for(check_ord, known_start_ord))
 
-    # Verify it's a Monday (0 = Monday in Python)
-    if known_start.weekday() != 0:
-        logger.warning(
-            f"Pay period start date {pay_period_start_date} is not a Monday!"
-        )
-
-    # Calculate days since known start
-    days_diff = (check_date - known_start).days
 
+@lru_cache(maxsize=256)
+def _pay_period_dates_for(check_ord, known_start_ord):
+    """Cached pay period calculation on date ordinals"""
     # Find the pay period number and offset
-    pay_period_num = days_diff // 14
-    days_into_period = days_diff % 14
+    pay_period_num, days_into_period = divmod(check_ord - known_start_ord, 14)
 
     # Calculate this pay period's start and end
-    period_start = known_start + timedelta(days=pay_period_num * 14)
-    period_end = period_start + timedelta(days=13)  # 14 days total, Monday to Sunday
+    period_start_ord = known_start_ord + pay_period_num * 14
+    period_end_ord = period_start_ord + 13  # 14 days total, Monday to Sunday
 
     return {
-        "start": period_start.strftime("%Y-%m-%d"),
-        "end": period_end.strftime("%Y-%m-%d"),
+        "start": _ymd_from_ordinal(period_start_ord),
+        "end": _ymd_from_ordinal(period_end_ord),
         "days_remaining": 13 - days_into_period,
         "current_day": days_into_period + 1,  # Day 1-14 of pay period
     }
 
 
-def get_pay_period_hours(date=None):
-    """Get hours for a pay period with proper weekly breakdown"""
-    period = get_pay_period_dates(date)
-    
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        
-        # Get the Sunday of week 1 (last day of week 1)
-        period_start = datetime.strptime(period["start"], "%Y-%m-%d")
-        week1_end = period_start + timedelta(days=6)  # Monday + 6 = Sunday
-        week1_end_str = week1_end.strftime("%Y-%m-%d")
-        
-        # Get ALL entries for the pay period
+def _parse_pay_period_start(pay_period_start_date):
+    """Parse a known pay period start date, warning if it isn't a Monday"""
+    known_start = _parse_ymd(pay_period_start_date)
+
+    # Verify it's a Monday (0 = Monday in Python)
+    if known_start.weekday() != 0:
+        logger.warning(
+            f"Pay period start date {pay_period_start_date} is not a Monday!"
+        )
+
+    return known_start
+
+
+# The configured pay period start, parsed once
+_KNOWN_START_ORD = _parse_pay_period_start(PAY_PERIOD_START).toordinal()
+
+
+def get_pay_period_hours(date=None, include_breakdown=False, period=None):
+    """
+    Get hours for a pay period with proper weekly breakdown.
+    The per-day breakdown is only queried when include_breakdown is set.
+    Callers that already have the period from get_pay_period_dates can pass
+    it in to skip recomputing it.
+    """
+    if period is None:
+        period = get_pay_period_dates(date)
+
+    conn = _conn()
+    cursor = conn.cursor()
+
+    # Get the Sunday of week 1 (last day of week 1)
+    period_start = _parse_ymd(period["start"])
+    week1_end = period_start + timedelta(days=6)  # Monday + 6 = Sunday
+    week1_end_str = week1_end.strftime("%Y-%m-%d")
+
+    # Read the weekly totals and the breakdown from one snapshot so they
+    # agree even if a batch is committed in between
+    with _read_transaction(conn):
+        # Aggregate each week in SQL. SQLite returns the bare hours_week
+        # column from the row holding MAX(date), i.e. the last weekly total.
         cursor.execute("""
-            SELECT date, hours_today, hours_week
+            SELECT date > ? AS is_week2, MAX(date), hours_week,
+                   SUM(hours_today), COUNT(*)
             FROM hours
             WHERE date >= ? AND date <= ?
-            ORDER BY date
-        """, (period["start"], period["end"]))
-        
-        all_entries = cursor.fetchall()
-        
-        # Process entries to get weekly totals
+            GROUP BY is_week2
+        """, (week1_end_str, period["start"], period["end"]))
+
         week1_hours = 0
         week2_hours = 0
         daily_sum = 0
-        daily_breakdown = []
-        
-        # Track the last hours_week value for each week
-        last_week1_entry = None
-        last_week2_entry = None
-        
-        for date_str, hours_today, hours_week in all_entries:
-            daily_breakdown.append({"date": date_str, "hours": hours_today})
-            daily_sum += hours_today
-            
-            # Determine which week this entry belongs to
-            entry_date = datetime.strptime(date_str, "%Y-%m-%d")
-            
-            if entry_date <= week1_end:
-                # Week 1 entry
-                last_week1_entry = (date_str, hours_week)
+        days_worked = 0
+
+        for is_week2, _, hours_week, hours_sum, count in cursor:
+            if is_week2:
+                week2_hours = hours_week
             else:
-                # Week 2 entry
-                last_week2_entry = (date_str, hours_week)
-        
-        # Use the last hours_week value from each week
-        if last_week1_entry:
-            week1_hours = last_week1_entry[1]
-            
-        if last_week2_entry:
-            week2_hours = last_week2_entry[1]
-        
-        # Total for pay period
-        total_hours = week1_hours + week2_hours
-        
-        # Calculate regular vs overtime
-        regular_hours = min(total_hours, 80)
-        overtime_hours = max(0, total_hours - 80)
-        
-        return {
-            "period_start": period["start"],
-            "period_end": period["end"],
-            "days_remaining": period["days_remaining"],
-            "total_hours": total_hours,
-            "week1_hours": week1_hours,
-            "week2_hours": week2_hours,
-            "daily_sum": daily_sum,
-            "discrepancy": total_hours - daily_sum,
-            "regular_hours": regular_hours,
-            "overtime_hours": overtime_hours,
-            "daily_breakdown": daily_breakdown,
-            "days_worked": len(daily_breakdown)
-        }
+                week1_hours = hours_week
+            daily_sum += hours_sum
+            days_worked += count
+
+        daily_breakdown = None
+        if include_breakdown:
+            cursor.execute("""
+                SELECT date, hours_today
+                FROM hours
+                WHERE date >= ? AND date <= ?
+                ORDER BY date
+            """, (period["start"], period["end"]))
+            daily_breakdown = [
+                {"date": date_str, "hours": hours_today}
+                for date_str, hours_today in cursor
+            ]
+
+    # Total for pay period
+    total_hours = week1_hours + week2_hours
+
+    # Calculate regular vs overtime
+    regular_hours = min(total_hours, 80)
+    overtime_hours = max(0, total_hours - 80)
+
+    result = {
+        "period_start": period["start"],
+        "period_end": period["end"],
+        "days_remaining": period["days_remaining"],
+        "total_hours": total_hours,
+        "week1_hours": week1_hours,
+        "week2_hours": week2_hours,
+        "daily_sum": daily_sum,
+        "discrepancy": total_hours - daily_sum,
+        "regular_hours": regular_hours,
+        "overtime_hours": overtime_hours,
+        "days_worked": days_worked
+    }
+
+    if daily_breakdown is not None:
+        result["daily_breakdown"] = daily_breakdown
+
+    return result
 
 
 def get_current_pay_period_info(date=None):
     """Get current pay period status with weekly totals properly handled"""
     period = get_pay_period_dates(date)
-    hours_data = get_pay_period_hours(date)
-    
+    hours_data = get_pay_period_hours(period=period)
+
     # Determine which week we're in
-    current_date = datetime.strptime(date or datetime.now().strftime("%Y-%m-%d"), "%Y-%m-%d")
-    period_start = datetime.strptime(period["start"], "%Y-%m-%d")
-    days_into_period = (current_date - period_start).days + 1
+    current_date = _parse_ymd(date or datetime.now().strftime("%Y-%m-%d"))
+    days_into_period = period["current_day"]
     current_week = 1 if days_into_period <= 7 else 2
     
     info = {
@@ -391,16 +649,12 @@ def get_current_pay_period_info(date=None):
     }
     
     # Calculate remaining work days (exclude Mondays)
-    remaining_days = []
-    current = current_date + timedelta(days=1)
-    end = datetime.strptime(period["end"], "%Y-%m-%d")
-    
-    while current <= end:
-        if current.weekday() != 0:  # Not Monday
-            remaining_days.append(current)
-        current += timedelta(days=1)
-    
-    info["remaining_work_days"] = len(remaining_days)
+    days_left = period["days_remaining"]
+    # Mondays among the days_left days starting tomorrow
+    tomorrow_weekday = (current_date.weekday() + 1) % 7
+    mondays_left = (days_left + (tomorrow_weekday + 6) % 7) // 7
+
+    info["remaining_work_days"] = days_left - mondays_left
     
     # Calculate hours needed per day
     if info["remaining_work_days"] > 0:
@@ -413,88 +667,141 @@ def get_current_pay_period_info(date=None):
 def get_pay_period_detail(date=None):
     """Get detailed daily hours for the pay period"""
     period = get_pay_period_dates(date)
-    
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        
-        # Get all daily entries in this pay period
-        cursor.execute("""
-            SELECT date, hours_today
-            FROM hours
-            WHERE date >= ? AND date <= ?
-            ORDER BY date
-        """, (period["start"], period["end"]))
-        
-        daily_hours = []
-        total_hours = 0
-        
-        for row in cursor.fetchall():
-            date, hours = row
-            daily_hours.append({
-                "date": date,
-                "hours": hours
-            })
-            total_hours += hours
-        
-        return {
-            "period_start": period["start"],
-            "period_end": period["end"],
-            "daily_hours": daily_hours,
-            "total_hours": total_hours,
-            "days_worked": len(daily_hours)
-        }
+
+    conn = _conn()
+    cursor = conn.cursor()
+
+    # Get all daily entries in this pay period
+    cursor.execute("""
+        SELECT date, hours_today
+        FROM hours
+        WHERE date >= ? AND date <= ?
+        ORDER BY date
+    """, (period["start"], period["end"]))
+
+    daily_hours = [{"date": date, "hours": hours} for date, hours in cursor]
+
+    # Totals from the same rows (at most 14), so they always match the list
+    return {
+        "period_start": period["start"],
+        "period_end": period["end"],
+        "daily_hours": daily_hours,
+        "total_hours": sum(day["hours"] for day in daily_hours),
+        "days_worked": len(daily_hours)
+    }
 
 
 def get_pay_history(num_periods=3):
     """Get pay period history with weekly breakdown"""
-    results = []
-    
+    if num_periods < 1:
+        return []
+
     # Start from current period and work backwards
-    current_period = get_pay_period_dates()
-    check_date = datetime.strptime(current_period["start"], "%Y-%m-%d")
-    
-    for i in range(num_periods):
-        # Calculate the date for this historical period
-        period_date = (check_date - timedelta(days=14 * i)).strftime("%Y-%m-%d")
-        
-        # Get the data for this pay period
-        period_data = get_pay_period_hours(period_date)
-        period_info = get_pay_period_dates(period_date)
-        
-        # Add to results
+    today_ord = datetime.now().toordinal()
+    current_start_ord = today_ord - (today_ord - _KNOWN_START_ORD) % 14
+    period_start_ords = [current_start_ord - 14 * i for i in range(num_periods)]
+    earliest_start = _ymd_from_ordinal(period_start_ords[-1])
+    current_end = _ymd_from_ordinal(current_start_ord + 13)
+
+    conn = _conn()
+    cursor = conn.cursor()
+
+    # Bucket every entry since the earliest period into its week in one query.
+    # SQLite returns the bare hours_week column from the row holding
+    # MAX(date), i.e. the last weekly total reported in that week.
+    cursor.execute("""
+        SELECT CAST(julianday(date) - julianday(?) AS INTEGER) / 7 AS week_idx,
+               MAX(date), hours_week, COUNT(*)
+        FROM hours
+        WHERE date >= ? AND date <= ?
+        GROUP BY week_idx
+    """, (earliest_start, earliest_start, current_end))
+
+    weeks = {week_idx: (hours_week, count) for week_idx, _, hours_week, count in cursor}
+
+    results = []
+    for i, period_start_ord in enumerate(period_start_ords):
+        # Weeks are numbered from the earliest period, two per period
+        week1_idx = 2 * (num_periods - 1 - i)
+        week1_hours, week1_days = weeks.get(week1_idx, (0, 0))
+        week2_hours, week2_days = weeks.get(week1_idx + 1, (0, 0))
+        total_hours = week1_hours + week2_hours
+
         results.append({
-            "period_start": period_info["start"],
-            "period_end": period_info["end"],
-            "total_hours": period_data["total_hours"],
-            "week1_hours": period_data["week1_hours"],
-            "week2_hours": period_data["week2_hours"],
-            "regular_hours": period_data["regular_hours"],
-            "overtime_hours": period_data["overtime_hours"],
-            "days_worked": period_data["days_worked"]
+            "period_start": _ymd_from_ordinal(period_start_ord),
+            "period_end": _ymd_from_ordinal(period_start_ord + 13),
+            "total_hours": total_hours,
+            "week1_hours": week1_hours,
+            "week2_hours": week2_hours,
+            "regular_hours": min(total_hours, 80),
+            "overtime_hours": max(0, total_hours - 80),
+            "days_worked": week1_days + week2_days
         })
-    
+
     return results
 
 
 def process_all():
     """Main processing function - could be called by cron or on-demand"""
-    init_db()
-    entries = load_entries()
+    # Nothing logged since the last run and nothing left from a failed one.
+    # Another processor may move the logfile aside at any point.
+    try:
+        pending = os.stat(LOGFILE).st_size > 0
+    except FileNotFoundError:
+        pending = False
+    if not pending and not _stale_processing_files():
+        logger.info("No entries to process")
+        return {"mileage": 0, "hours": 0}
 
-    if not entries:
+    init_db()
+    claimed = rotate_logfile()
+    if claimed is None:
         logger.info("No entries to process")
         return {"mileage": 0, "hours": 0}
 
-    logger.info(f"Processing {len(entries)} total entries")
+    path, lock_file = claimed
+    with lock_file:
+        return _process_file(path)
 
-    mileage_count = process_mileage(entries)
-    hours_count = process_hours(entries)
 
-    clear_logfile()
+def _process_file(path):
+    """Store the entries in a claimed processing file, then remove it"""
+    try:
+        mileage_entries, hours_entries = load_entries(path)
+        total = len(mileage_entries) + len(hours_entries)
+
+        if not total:
+            logger.info("No entries to process")
+            os.remove(path)
+            return {"mileage": 0, "hours": 0}
+
+        logger.info(f"Processing {total} total entries")
+
+        # Write both tables in one transaction (a single commit)
+        with _transaction(_conn()):
+            mileage_count = process_mileage(mileage_entries)
+            hours_count = process_hours(hours_entries)
+    except sqlite3.OperationalError:
+        # Locked or unavailable database; retry the file on the next run
+        raise
+    except Exception:
+        failed = (
+            f"{path[:-len(PROCESSING_SUFFIX)]}."
+            f"{datetime.now():%Y%m%d%H%M%S%f}{FAILED_SUFFIX}"
+        )
+        os.rename(path, failed)
+        logger.error(f"Processing failed, moved entries to {failed}")
+        raise
+
+    # Only remove the file once its entries are committed
+    os.remove(path)
+    logger.info("Logfile cleared")
 
-    return {"mileage": mileage_count, "hours": hours_count, "total": len(entries)}
+    return {"mileage": mileage_count, "hours": hours_count, "total": total}
 
 
 if __name__ == "__main__":
+    # Always create the schema, even when there is nothing to process
+    init_db()
     result = process_all()
     print(f"Processing complete: {result}")
\ No newline at end of file
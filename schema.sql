@@ -23,15 +23,15 @@ CREATE TABLE IF NOT EXISTS mileage_summary (
 );
 
 -- Hours tracking tables
+-- Keyed on date (one row per day) so date lookups hit the table B-tree directly
 CREATE TABLE IF NOT EXISTS hours (
-    id TEXT PRIMARY KEY,
-    date TEXT NOT NULL,
+    id TEXT NOT NULL UNIQUE,
+    date TEXT PRIMARY KEY,
     hours_today REAL NOT NULL,
     hours_week REAL NOT NULL,
     received_at TEXT NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    UNIQUE(date)
-);
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) WITHOUT ROWID;
 
 -- Optional: Pay period summary table for faster queries
 CREATE TABLE IF NOT EXISTS pay_period_summary (
@@ -48,10 +48,13 @@ CREATE TABLE IF NOT EXISTS pay_period_summary (
 );
 
 -- Create indices for better query performance
+-- (name, date) lookups on mileage_summary and date lookups on hours are
+-- covered by their UNIQUE / PRIMARY KEY constraints
 CREATE INDEX IF NOT EXISTS idx_mileage_raw_date ON mileage_raw(date);
-CREATE INDEX IF NOT EXISTS idx_mileage_raw_name_date ON mileage_raw(name, date);
-CREATE INDEX IF NOT EXISTS idx_hours_date ON hours(date);
-CREATE INDEX IF NOT EXISTS idx_mileage_summary_date ON mileage_summary(date);
+DROP INDEX IF EXISTS idx_mileage_raw_name_date;
+CREATE INDEX IF NOT EXISTS idx_mileage_raw_name_date_pos ON mileage_raw(name, date, position);
+DROP INDEX IF EXISTS idx_mileage_summary_date;
+CREATE INDEX IF NOT EXISTS idx_mileage_summary_date_name ON mileage_summary(date DESC, name);
 
 -- Create a view for easy mileage querying
 CREATE VIEW IF NOT EXISTS mileage_daily AS